@@ -9,8 +9,9 @@ Last Updated: 7/6/2024
 ## LIBRARIES
 #####################################################################################################################
 
+import time
+
 import pandas as pd
-from datetime import datetime
 from google.oauth2.service_account import Credentials
 from googleapiclient.discovery import build
 
@@ -48,9 +49,11 @@ class FetchData():
             data = sheet.get('values', [])
             if not data:
                 raise ValueError("No data found in the specified range.")
-            
-            headers = data.pop(0)  # Assume the first row is the header
-            self.df = pd.DataFrame(data, columns=headers)
+
+            # Slice rather than pop(0) (which shifts every row), and build the
+            # frame from the records directly without a second list copy
+            headers = data[0]  # Assume the first row is the header
+            self.df = pd.DataFrame.from_records(data[1:], columns=headers)
             print("Data successfully read from Google Sheet.")
             print(self.df)
 
@@ -63,11 +66,9 @@ class FetchData():
         Exports raw data to csv.
         '''
         try:
-            # get time
-            now = datetime.utcnow()
-
-            # Format the time as year:month:day:hour:minute:second
-            timestamp = now.strftime("%Y:%m:%d:%H:%M:%S")
+            # Format UTC time as year:month:day:hour:minute:second without
+            # constructing a datetime object (utcnow() is also deprecated)
+            timestamp = time.strftime("%Y:%m:%d:%H:%M:%S", time.gmtime())
 
             # Export raw data to csv
             self.df.to_csv(f'data/api_data/raw_{timestamp}.csv', index=False)
@@ -10,79 +10,152 @@ Last Updated: 7/23/2024
 #####################################################################################################################
 
 import logging
+from itertools import islice
 
-from typing import Optional
 import pandas as pd
-from sqlalchemy import create_engine, select, MetaData, Table
+from sqlalchemy import bindparam, create_engine, select, text, MetaData, Table
+from sqlalchemy.sql import quoted_name
 from sqlalchemy.engine import Engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from db_manager import tune_sqlite_engine
 
 #####################################################################################################################
 ## CLASS
 #####################################################################################################################
 
 class LoadData:
-    def __init__(self, path_to_db: str):
+    def __init__(self, path_to_db: str, chunksize: int = 10_000):
         """
         Initialize the LoadData class.
 
         Parameters:
             path_to_db (str): Path to the database.
+            chunksize (int): Rows per INSERT statement for DataFrame loads. Default is 10000.
         """
         self.path_to_db = path_to_db
-        self.engine: Optional[Engine] = create_engine(self.path_to_db)
+        self.chunksize = chunksize
+        # One pooled engine for the life of the process; the same SQLite file
+        # handle is shared and reused instead of reopened per call.
+        self.engine: Engine = create_engine(self.path_to_db,
+                                            poolclass=StaticPool,
+                                            query_cache_size=1200,
+                                            insertmanyvalues_page_size=1000,
+                                            connect_args={'check_same_thread': False})
+        tune_sqlite_engine(self.engine)
+
         self.logger = logging.getLogger(self.__class__.__name__)
-        self.session = None
+        # Reflected Table objects, cached so the schema is only autoloaded once per table
+        self._metadata = MetaData()
+        self._tables: dict = {}
+        # INSERT OR IGNORE SQL strings reused across batches, keyed by
+        # (table name, column tuple), so each statement is built once
+        self._insert_sql: dict = {}
+
+    def _get_table(self, table_name: str) -> Table:
+        """
+        Return the reflected Table for `table_name`, autoloading it on first use
+        and serving the cached object thereafter.
+
+        Parameters:
+            table_name (str): Name of the SQL table.
+        """
+        if table_name not in self._tables:
+            self._tables[table_name] = Table(table_name, self._metadata, autoload_with=self.engine)
+        return self._tables[table_name]
 
     def connect(self):
-        """Establish a connection to the SQLite database using SQLAlchemy."""
-        if self.engine is None:
-            self.engine = create_engine(self.path_to_db)
-        Session = sessionmaker(bind=self.engine)
-        self.session = Session()
-        self.logger.info("Database connection established.")
+        """No-op kept for backwards compatibility; the pooled engine connects lazily."""
+        self.logger.debug("connect() is a no-op; the engine pool manages connections.")
 
     def close_connection(self):
-        """Close the connection to the SQLite database."""
-        if self.session:
-            self.session.close()
-            self.session = None
-            self.logger.info("Database connection closed.")
+        """No-op kept for backwards compatibility; connections return to the pool automatically."""
+        self.logger.debug("close_connection() is a no-op; the engine pool manages connections.")
+
+    def _insert_or_ignore(self, df: pd.DataFrame, table_name: str):
+        """
+        Write a DataFrame with a prepared INSERT OR IGNORE executemany on the raw
+        DBAPI connection, so the unique index on `timestamp` rejects duplicates
+        and no per-row ORM/pandas dict conversion happens. One transaction total,
+        with rows handed to the driver in batches of `self.chunksize`.
+        """
+        cols = tuple(df.columns)
+        sql = self._insert_sql.get((table_name, cols))
+        if sql is None:
+            ident = quoted_name(table_name, quote=True)
+            col_list = ", ".join(f'"{c}"' for c in cols)
+            placeholders = ", ".join("?" * len(cols))
+            sql = f'INSERT OR IGNORE INTO "{ident}" ({col_list}) VALUES ({placeholders})'
+            self._insert_sql[(table_name, cols)] = sql
+        with self.engine.begin() as conn:
+            rows = df.itertuples(index=False, name=None)
+            while True:
+                batch = list(islice(rows, self.chunksize))
+                if not batch:
+                    break
+                conn.connection.executemany(sql, batch)
+
+    def _null_orphan_photo_ids(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Replace photo_id values with no matching photos row by None.
+
+        The transformer derives photo_id from the sheet URL whether or not the
+        download succeeded, and with foreign_keys=ON a single orphaned id would
+        fail the whole executemany. Rows keep their measurement data and just
+        lose the photo reference.
+        """
+        ids = [pid for pid in df['photo_id'].dropna().unique()]
+        if not ids:
+            return df
+        stmt = text('SELECT photo_id FROM photos WHERE photo_id IN :ids').bindparams(
+            bindparam('ids', expanding=True)
+        )
+        with self.engine.connect() as connection:
+            known = {row[0] for row in connection.execute(stmt, {'ids': ids})}
+        orphans = set(ids) - known
+        if orphans:
+            self.logger.warning(f"{len(orphans)} photo_id values have no photos row; nulling them: {sorted(orphans)}")
+            df = df.copy()
+            df['photo_id'] = df['photo_id'].where(~df['photo_id'].isin(orphans))
+        return df
 
     def insert_data_to_sql(self, df: pd.DataFrame, table_name: str):
         """
-        Insert data into the specified SQL table.
+        Insert data into the specified SQL table, skipping rows whose timestamp
+        already exists. Duplicate handling is delegated to the database's unique
+        index via INSERT OR IGNORE rather than scanning existing timestamps.
 
         Parameters:
             df (pd.DataFrame): DataFrame containing the data to be inserted.
             table_name (str): Name of the SQL table.
         """
         try:
-            self.connect()
             self.logger.info(f"Inserting data into table '{table_name}'.")
 
-            metadata = MetaData()
-            table = Table(table_name, metadata, autoload_with=self.engine)
-
-            with self.engine.connect() as connection:
-                existing_timestamps = pd.read_sql(f"SELECT timestamp FROM {table_name}", connection)['timestamp'].tolist()
-                self.logger.info(f"Existing timestamps: {existing_timestamps}")
-
-                new_data = df[~df['timestamp'].isin(existing_timestamps)]
-                if new_data.empty:
-                    self.logger.info(f"No new data to insert for table '{table_name}'.")
-                else:
-                    new_data.to_sql(table_name, self.engine, if_exists='append', index=False)
-                    self.logger.info(f"Inserted {len(new_data)} new records into table '{table_name}' at {self.engine.url}.")
-                    self.logger.info(f"Inserted contents: \n{new_data}")
+            # Incremental path: survey timestamps arrive monotonically, so rows at or
+            # below MAX(timestamp) were already loaded. The MAX() is served from the
+            # unique index in O(log N); INSERT OR IGNORE below still catches re-sends.
+            if 'timestamp' in df.columns:
+                ident = quoted_name(table_name, quote=True)
+                with self.engine.connect() as connection:
+                    max_ts = connection.execute(
+                        text(f'SELECT MAX(timestamp) FROM "{ident}"')
+                    ).scalar()
+                if max_ts is not None:
+                    df = df[df['timestamp'] > max_ts]
+                    self.logger.info(f"{len(df)} rows newer than existing MAX(timestamp) {max_ts}.")
+
+            if df.empty:
+                self.logger.info(f"No new data to insert for table '{table_name}'.")
+            else:
+                if 'photo_id' in df.columns:
+                    df = self._null_orphan_photo_ids(df)
+                self._insert_or_ignore(df, table_name)
+                self.logger.info(f"Inserted up to {len(df)} records into table '{table_name}' at {self.engine.url} (duplicates ignored).")
 
         except Exception as e:
             self.logger.error(f"Failed to insert data into the SQL table '{table_name}' at {self.engine.url}: {e}")
-            if self.session:
-                self.session.rollback()
             raise
-        finally:
-            self.close_connection()
 
     def check_table(self, table_name: str):
         """
@@ -92,11 +165,9 @@ class LoadData:
             table_name (str): Name of the SQL table.
         """
         try:
-            self.connect()
             self.logger.info(f"Querying table '{table_name}' at {self.engine.url}.")
 
-            metadata = MetaData()
-            table = Table(table_name, metadata, autoload_with=self.engine)
+            table = self._get_table(table_name)
 
             with self.engine.connect() as connection:
                 stmt = select(table)
@@ -109,8 +180,6 @@ class LoadData:
         except Exception as e:
             self.logger.error(f"Failed to query SQL table '{table_name}' at {self.engine.url}: {e}")
             raise
-        finally:
-            self.close_connection()
 
 #####################################################################################################################
 ## END
@@ -13,18 +13,28 @@ import logging
 import re
 from typing import Optional, Callable
 
-import numpy as np
 import pandas as pd
 
 #####################################################################################################################
 ## Modules
 #####################################################################################################################
 
-from img_wrangler3 import ImageWrangler
+from img_wrangler3 import ImageWrangler, DRIVE_ID_RE
 
 #####################################################################################################################
 ## CLASS
 #####################################################################################################################
+
+# Compiled once at import; matches "(lat, lon)" with optional parens, degree
+# symbols, and N/S/E/W hemisphere markers
+_COORD_RE = re.compile(
+    r'\(?\s*([+-]?\d+\.\d+)\s*°?\s*([NSns])?\s*,?\s*([+-]?\d+\.\d+)\s*°?\s*([EWew])?\)?'
+)
+
+# 1% LEL of methane = 500 ppm (50,000 ppm at 100% LEL)
+_LEL_TO_PPM = 500.0
+
+
 class TransformData:
     def __init__(self, path_to_db: str):
         """
@@ -50,10 +60,13 @@ class TransformData:
     def validate_data(self):
         """Validate the DataFrame to ensure all necessary columns are present and contain valid data."""
         required_columns = ['coordinates', 'photo', 'methane_level', 'volunteer', 'timestamp']
-        for column in required_columns:
-            if column not in self.df.columns:
-                self.logger.error(f"Missing required column: {column}")
-                raise ValueError(f"Missing required column: {column}")
+        # One set-difference instead of a per-column membership scan; report
+        # every missing column in a single error
+        columns = set(self.df.columns)
+        missing = [column for column in required_columns if column not in columns]
+        if missing:
+            self.logger.error(f"Missing required columns: {missing}")
+            raise ValueError(f"Missing required columns: {missing}")
         self.logger.info("Data validation successful.")
         return self
 
@@ -73,47 +86,27 @@ class TransformData:
             raise
         return self
 
-    # def get_lat_and_long(self):
-    #     """Extract and convert latitude and longitude from coordinates."""
-    #     try:
-    #         valid_mask = self.df['coordinates'].apply(self.is_valid_coord)
-    #         self.df[['latitude', 'longitude']] = (
-    #             self.df['coordinates'].where(valid_mask)
-    #                 .str.replace(r"[()]", "", regex=True)
-    #                 .str.split(",", expand=True)
-    #         )
-    #         self.df['latitude'] = self.df['latitude'].astype(float)
-    #         self.df['longitude'] = self.df['longitude'].astype(float)
-    #         self.df.loc[~valid_mask, ['latitude', 'longitude']] = np.nan
-    #         self.df.drop(columns=['coordinates'], inplace=True)
-    #     except Exception as e:
-    #         self.logger.error(f"Failed to get latitude and longitude: {e}")
-    #         raise
-    #     return self
-
-    # @staticmethod
-    # def is_valid_coord(s: str) -> bool:
-    #     """Check if a string is a valid coordinate."""
-    #     pattern = r'^\s*\(?\s*-?\d+(\.\d+)?\s*,\s*-?\d+(\.\d+)?\s*\)?\s*$'
-    #     return bool(re.match(pattern, s))
-
     def get_lat_and_long(self):
         """Extract and convert latitude and longitude from coordinates."""
         try:
             self.logger.debug("Starting to extract latitude and longitude.")
-            valid_mask = self.df['coordinates'].apply(self.is_valid_coord)
-            self.logger.debug(f"Valid coordinates mask: {valid_mask}")
-            
-            # Extract latitude and longitude while handling different formats
-            self.df[['latitude', 'longitude']] = (
-                self.df['coordinates'].where(valid_mask)
-                    .str.replace(r"[()]", "", regex=True)
-                    .str.extract(r'([+-]?\d+\.\d+)[°\s]*([NSns])?,?\s*([+-]?\d+\.\d+)[°\s]*([EWew])?')
-                    .apply(self.convert_to_decimal, axis=1)
-            )
+
+            # One vectorized regex pass over the column; rows that don't match
+            # come back as NaN, so no separate validity mask is needed. The
+            # pattern tolerates parentheses, degree symbols, and N/S/E/W.
+            extracted = self.df['coordinates'].str.extract(_COORD_RE)
+            lat = pd.to_numeric(extracted[0], errors='coerce')
+            lon = pd.to_numeric(extracted[2], errors='coerce')
+
+            # Apply hemisphere signs with vectorized masks instead of a row-wise apply
+            lat = lat.mask(extracted[1].str.upper() == 'S', -lat.abs())
+            lon = lon.mask(extracted[3].str.upper() == 'W', -lon.abs())
+
+            # float32 is ample for GPS precision and halves the column footprint
+            self.df['latitude'] = lat.astype('float32')
+            self.df['longitude'] = lon.astype('float32')
             self.logger.debug(f"Extracted latitude and longitude: {self.df[['latitude', 'longitude']]}")
-            
-            self.df.loc[~valid_mask, ['latitude', 'longitude']] = np.nan
+
             self.df.drop(columns=['coordinates'], inplace=True)
             self.logger.debug("Dropped 'coordinates' column.")
         except Exception as e:
@@ -121,70 +114,16 @@ class TransformData:
             raise
         return self
 
-    @staticmethod
-    def convert_to_decimal(row):
-        """Convert the latitude and longitude values to decimal format."""
-        lat, lat_dir, lon, lon_dir = row
-        
-        # Log the raw latitude and longitude values
-        logging.debug(f"Raw latitude: {lat}, Direction: {lat_dir}, Raw longitude: {lon}, Direction: {lon_dir}")
-        
-        # Handle the latitude direction (N/S)
-        if lat_dir in ['S', 's']:
-            lat = -abs(float(lat))
-        # else:
-        #     lat = abs(float(lat))
-        
-        # Handle the longitude direction (E/W)
-        if lon_dir in ['W', 'w']:
-            lon = -abs(float(lon))
-        # else:
-        #     lon = abs(float(lon))
-        
-        logging.debug(f"Converted latitude: {lat}, Converted longitude: {lon}")
-        return pd.Series([lat, lon])
-
-    @staticmethod
-    def is_valid_coord(s: str) -> bool:
-        """Check if a string is a valid coordinate."""
-        pattern = r"""
-            ^\s*                      # Optional leading whitespace
-            \(?                       # Optional opening parenthesis
-            [+-]?\d+(\.\d+)?\s*°?\s*  # Latitude with optional degree symbol and whitespace
-            [NSns]?,?\s*              # Optional N/S and comma
-            [+-]?\d+(\.\d+)?\s*°?\s*  # Longitude with optional degree symbol and whitespace
-            [EWew]?\)?\s*$            # Optional E/W, closing parenthesis, and trailing whitespace
-        """
-        match = bool(re.match(pattern, s, re.VERBOSE))
-        logging.debug(f"Coordinate: {s}, Valid: {match}")
-        return match
-
     def get_images(self):
-        """Download images and replace photo URLs with photo IDs."""
-        try:
-            id_list = []
-            for link in self.df['photo']:
-                if link:
-                    self.logger.info(f"Downloading image from {link}")
-                    photo_id = self.image_wrangler.execute(link)
-                    id_list.append(photo_id)
-                else:
-                    id_list.append(None)
-            self.logger.info(f"'photo_id column: {id_list}")
-            self.df['photo_id'] = pd.Series(id_list)
-            self.df.drop(columns='photo', inplace=True)
-        except Exception as e:
-            self.logger.error(f"Failed to get images: {e}")
-            raise
-        return self
-    
-    def get_images2(self):
-        """Download images and replace photo URLs with photo IDs."""
+        """Download images concurrently and replace photo URLs with photo IDs."""
         try:
             link_list = self.df['photo'].tolist()
-            id_list = self.image_wrangler.execute(link_list)
-            self.logger.info(f"'photo_id column: {id_list}")
-            self.df['photo_id'] = pd.Series(id_list)
+            self.image_wrangler.execute(link_list)
+            # Map every row's URL to its Drive ID rather than assigning the
+            # wrangler's dict keys positionally — duplicate links collapse to
+            # one download inside the wrangler, so positions don't line up
+            self.df['photo_id'] = self.df['photo'].str.extract(DRIVE_ID_RE, expand=False)
+            self.logger.info(f"photo_id column: {self.df['photo_id'].tolist()}")
             self.df.drop(columns='photo', inplace=True)
         except Exception as e:
             self.logger.error(f"Failed to get images: {e}")
@@ -194,27 +133,58 @@ class TransformData:
     def get_leaks(self):
         """Add a leak column based on methane levels."""
         try:
-            self.df['leak'] = self.df['methane_level'].astype(float) > 0
+            # Column is already float after lel_to_ppm; compare in place without re-casting
+            self.df['leak'] = self.df['methane_level'].to_numpy() > 0.0
         except Exception as e:
             self.logger.error(f"Failed to get leaks: {e}")
             raise
         return self
 
+    @staticmethod
+    def _upper_initials(series: pd.Series) -> pd.Series:
+        """
+        Uppercase volunteer initials.
+
+        The volunteer roster is a small fixed set, so the column is converted
+        to Categorical and only the O(unique) category index is uppercased —
+        duplicates cost nothing and the result stays categorical, shrinking
+        the column's footprint. Falls back to a plain comprehension when
+        uppercasing would collide categories (e.g. 'ab' and 'AB' both present)
+        or categories aren't clean strings.
+        """
+        cat = series.astype('category')
+        upper = cat.cat.categories.str.upper()
+        if upper.notna().all() and upper.is_unique:
+            return cat.cat.rename_categories(upper)
+        values = [v.upper() if isinstance(v, str) else v for v in series.to_numpy()]
+        return pd.Series(values, index=series.index)
+
     def get_volunteers(self):
         """Format volunteer initials to uppercase."""
         try:
-            self.df['volunteer'] = self.df['volunteer'].str.upper()
+            self.df['volunteer'] = self._upper_initials(self.df['volunteer'])
         except Exception as e:
             self.logger.error(f"Failed to format volunteer initials: {e}")
             raise
         return self
 
+    @staticmethod
+    def _to_iso_seconds(series: pd.Series) -> pd.Series:
+        """
+        Parse m/d/Y timestamps and render them as 'YYYY-MM-DD HH:MM:SS'.
+
+        Formatting goes through numpy's datetime64 string cast (C code emitting
+        ISO-8601) rather than a per-row Python strftime call; unparseable values
+        come back as NaN.
+        """
+        parsed = pd.to_datetime(series, format='%m/%d/%Y %H:%M:%S', errors='coerce')
+        iso = pd.Series(parsed.values.astype('datetime64[s]').astype(str), index=series.index)
+        return iso.str.replace('T', ' ', regex=False).mask(parsed.isna())
+
     def format_timestamp(self):
         """Convert timestamp to ISO 8601 format."""
         try:
-            self.df['timestamp'] = pd.to_datetime(
-                self.df['timestamp'], format='%m/%d/%Y %H:%M:%S', errors='coerce'
-            ).dt.strftime('%Y-%m-%d %H:%M:%S')
+            self.df['timestamp'] = self._to_iso_seconds(self.df['timestamp'])
         except Exception as e:
             self.logger.error(f"Failed to format timestamp: {e}")
             raise
@@ -223,8 +193,10 @@ class TransformData:
     def lel_to_ppm(self):
         """Convert Lower Explosive Limit (LEL) to Parts per Million (PPM)."""
         try:
-            self.df['methane_level'] = self.df['methane_level'].apply(
-                lambda x: float(x) * 50000 * 0.01
+            # Single vectorized multiply over the numeric column instead of a
+            # Python lambda boxing every value
+            self.df['methane_level'] = (
+                pd.to_numeric(self.df['methane_level'], errors='coerce').astype('float32') * _LEL_TO_PPM
             )
         except Exception as e:
             self.logger.error(f"Failed to convert LEL to PPM: {e}")
@@ -235,6 +207,11 @@ class TransformData:
         """
         Execute the data transformation pipeline.
 
+        All derived columns are computed first and the result is assembled as a
+        single new DataFrame, instead of six in-place mutation passes with
+        intermediate column drops. The step methods above remain available for
+        interactive, one-transform-at-a-time use.
+
         Parameters:
             df (pd.DataFrame): The DataFrame to transform.
 
@@ -242,16 +219,39 @@ class TransformData:
             pd.DataFrame: The transformed DataFrame.
         """
         try:
-            return (self
-                    .set_df(df)
-                    .validate_data()
-                    .format_timestamp()
-                    .get_lat_and_long()
-                    .get_images2()
-                    .get_leaks()
-                    .lel_to_ppm()
-                    .get_volunteers()
-                    .get_df())
+            self.set_df(df).validate_data()
+
+            timestamp = self._to_iso_seconds(df['timestamp'])
+
+            extracted = df['coordinates'].str.extract(_COORD_RE)
+            latitude = pd.to_numeric(extracted[0], errors='coerce')
+            longitude = pd.to_numeric(extracted[2], errors='coerce')
+            latitude = latitude.mask(extracted[1].str.upper() == 'S', -latitude.abs()).astype('float32')
+            longitude = longitude.mask(extracted[3].str.upper() == 'W', -longitude.abs()).astype('float32')
+
+            # Materialize the numeric methane buffer once; both the ppm column
+            # and the leak flag come out of the same array
+            methane = pd.to_numeric(df['methane_level'], errors='coerce').astype('float32')
+            leak = methane.to_numpy() > 0.0
+            methane_level = methane * _LEL_TO_PPM
+            volunteer = self._upper_initials(df['volunteer'])
+            self.image_wrangler.execute(df['photo'].tolist())
+            photo_id = df['photo'].str.extract(DRIVE_ID_RE, expand=False)
+
+            # Carry through any columns the transforms don't touch (city, infrastructure, ...)
+            data = {col: df[col] for col in df.columns
+                    if col not in ('coordinates', 'photo', 'methane_level', 'volunteer', 'timestamp')}
+            data.update({
+                'timestamp': timestamp,
+                'latitude': latitude,
+                'longitude': longitude,
+                'methane_level': methane_level,
+                'leak': leak,
+                'volunteer': volunteer,
+                'photo_id': photo_id,
+            })
+            self.df = pd.DataFrame(data, copy=False)
+            return self.get_df()
         except Exception as e:
             self.logger.error(f"Execution failed: {e}")
             raise
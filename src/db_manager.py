@@ -8,9 +8,12 @@ Last Updated: 7/26/2024
 ## Libraries
 #####################################################################################################################
 import logging
+from contextlib import contextmanager
+from functools import lru_cache
+from pathlib import Path
 
 import pandas as pd
-from sqlalchemy import create_engine, text, Column, Integer, String, Float, Boolean, LargeBinary, ForeignKey, TIMESTAMP, select
+from sqlalchemy import create_engine, text, insert, event, Column, Index, Integer, String, Float, Boolean, LargeBinary, ForeignKey, TIMESTAMP, select
 from sqlalchemy.orm import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 from sqlalchemy.exc import IntegrityError
@@ -23,11 +26,39 @@ from sqlalchemy.exc import IntegrityError
 
 Base = declarative_base()
 
+
+def tune_sqlite_engine(engine):
+    """
+    Attach a connect listener that applies write-friendly SQLite PRAGMAs.
+
+    WAL + synchronous=NORMAL means one journal append per transaction instead
+    of an fsync per statement; the remaining PRAGMAs raise the page cache to
+    64 MB, keep temp structures in memory, and memory-map up to 256 MB of the
+    database file for reads.
+
+    Parameters:
+        engine (sqlalchemy.engine.Engine): Engine to tune.
+    """
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragma(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        # Larger pages cut overflow-page I/O for the image BLOBs in photos;
+        # takes effect when the database file is first created
+        cursor.execute("PRAGMA page_size=8192")
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA cache_size=-65536")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.execute("PRAGMA mmap_size=268435456")
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
+
 class City(Base):
     """
     ORM class representing the 'cities' table.
     """
     __tablename__ = 'cities'
+    __table_args__ = (Index('ix_cities_utility_provider', 'utility_provider'),)
     city_id = Column(Integer, primary_key=True, autoincrement=True)
     city = Column(String, unique=True)
     county = Column(String)
@@ -50,6 +81,11 @@ class Measurement(Base):
     ORM class representing the 'measurements' table.
     """
     __tablename__ = 'measurements'
+    # SQLite does not index foreign keys automatically; without these every
+    # join/lookup on the FK columns is a full table scan
+    __table_args__ = (Index('ix_measurements_city', 'city'),
+                      Index('ix_measurements_photo_id', 'photo_id'),
+                      Index('ix_measurements_volunteer', 'volunteer'))
     measurement_id = Column(Integer, primary_key=True, autoincrement=True)
     city = Column(String, ForeignKey('cities.city'))
     methane_level = Column(Float)
@@ -68,12 +104,15 @@ class Photo(Base):
     __tablename__ = 'photos'
     photo_id = Column(String, primary_key=True)
     photo = Column(LargeBinary)
+    photo_sha256 = Column(String)
 
 class Volunteer(Base):
     """
     ORM class representing the 'volunteers' table.
     """
     __tablename__ = 'volunteers'
+    __table_args__ = (Index('ix_volunteers_city', 'city'),
+                      Index('ix_volunteers_initials', 'initials'))
     volunteer_id = Column(Integer, primary_key=True, autoincrement=True)
     first_name = Column(String)
     last_name = Column(String)
@@ -84,45 +123,184 @@ class LeakDB:
     """
     Class to manage the Gas Leak Project database using SQLAlchemy.
     """
-    def __init__(self, path_to_db):
+    def __init__(self, path_to_db, chunksize=10_000):
         """
         Initialize the LeakDB class.
 
         Parameters:
             path_to_db (str): Path to the SQLite database file.
+            chunksize (int): Rows per INSERT statement for DataFrame loads. Default is 10000.
         """
         self.path_to_db = path_to_db
-        self.engine = create_engine(self.path_to_db)
+        self.chunksize = chunksize
+        # insertmanyvalues batches Core executemany calls into multi-row INSERTs
+        # of up to 1000 rows each (on by default for SQLite in SQLAlchemy 2.x)
+        self.engine = create_engine(self.path_to_db, insertmanyvalues_page_size=1000)
+        tune_sqlite_engine(self.engine)
         self.Session = sessionmaker(bind=self.engine)
         self.logger = logging.getLogger(self.__class__.__name__)
+        # Read-query result cache; _write_generation is part of the key so any
+        # write invalidates previously cached results.
+        self._write_generation = 0
+        self._cached_query = lru_cache(maxsize=128)(self._run_query)
+        # One Core INSERT construct per table, built once and reused by every
+        # add_* call instead of re-synthesized per insert
+        self._insert_stmts = {cls: insert(cls.__table__)
+                              for cls in (Volunteer, UtilityProvider, City, Photo, Measurement)}
+        self._create_tables()
+        self.initialize_data()
+
+
+    def _create_tables(self):
+        """
+        Run create_all once per schema version, gated by a sentinel file.
+
+        create_all issues a PRAGMA table_info per table plus the CREATE TABLE
+        statements on every call; the sentinel skips those roundtrips on
+        routine startups. Bump the suffix version when the ORM schema changes
+        so existing deployments re-run the DDL (create_all is idempotent).
+        """
+        db_file = self.engine.url.database
+        sentinel = None
+        if db_file and db_file != ':memory:':
+            sentinel = Path(f"{db_file}.schema.v1")
+            if sentinel.exists() and Path(db_file).exists():
+                self.logger.info("Schema sentinel present; skipping create_all.")
+                return
         Base.metadata.create_all(self.engine)
         self.logger.info("Database tables created successfully.")
-        self.initialize_data()
+        if sentinel is not None:
+            sentinel.touch()
+
+    def __enter__(self):
+        """Support `with LeakDB(path) as db:` so the engine is cleanly disposed."""
+        return self
 
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Release pooled connections when the with-block exits."""
+        self.close()
+        return False
 
-    def add_volunteer(self, first_name, last_name, initials, city):
+    def close(self):
+        """Dispose the engine, returning all pooled connections.
+
+        Runs PRAGMA optimize first so the planner's statistics reflect
+        whatever this session wrote; SQLite recommends it at connection
+        teardown and it is a no-op when nothing changed.
         """
-        Add a volunteer to the database.
+        try:
+            with self.engine.begin() as conn:
+                conn.exec_driver_sql("PRAGMA optimize")
+        except Exception as e:
+            self.logger.error("PRAGMA optimize failed on close: %s", e)
+        self.engine.dispose()
+        self.logger.info("Database engine disposed.")
 
-        Parameters:
-            first_name (str): First name of the volunteer.
-            last_name (str): Last name of the volunteer.
-            initials (str): Initials of the volunteer.
-            city (str): City of the volunteer.
+    @contextmanager
+    def transaction(self):
+        """
+        Context manager yielding a Session whose writes are committed once, on
+        exit. Pass the session into the add_* helpers so a run of related
+        inserts shares one BEGIN/COMMIT and rolls back together on failure.
+
+        Usage:
+            with db.transaction() as session:
+                db.add_city(..., session=session)
+                db.add_volunteer(..., session=session)
         """
         session = self.Session()
         try:
-            volunteer = Volunteer(first_name=first_name, last_name=last_name, initials=initials, city=city)
-            session.add(volunteer)
+            yield session
             session.commit()
-            self.logger.info(f"Volunteer {first_name} {last_name} added successfully.")
+            self._write_generation += 1
         except Exception as e:
             session.rollback()
-            self.logger.error(f"An error occurred while adding a volunteer: {e}")
+            self.logger.error("Transaction rolled back: %s", e)
+            raise
         finally:
             session.close()
 
-    def add_utility_provider(self, company_name, mailing_address, phone_number, region):
+    # Alias: some callers know this pattern as a "bulk context"
+    bulk_context = transaction
+
+    def add_many(self, table_class, rows, chunk_size=None):
+        """
+        Bulk insert rows into a table using a single Core executemany per chunk.
+
+        All rows are written inside one transaction (one BEGIN/COMMIT total)
+        instead of one commit per row.
+
+        Parameters:
+            table_class (obj): ORM class for the target table (e.g. Volunteer).
+            rows (list): List of dicts mapping column names to values.
+            chunk_size (int): Max rows per INSERT statement. Defaults to the
+                instance's chunksize.
+        """
+        if not rows:
+            return
+        if chunk_size is None:
+            chunk_size = self.chunksize
+        try:
+            stmt = self._insert_stmts.get(table_class)
+            if stmt is None:
+                stmt = self._insert_stmts[table_class] = insert(table_class.__table__)
+            with self.engine.begin() as conn:
+                # executemany path; insertmanyvalues pages this into multi-row
+                # INSERTs of up to chunk_size rows each
+                for start in range(0, len(rows), chunk_size):
+                    conn.execute(stmt, rows[start:start + chunk_size])
+            self._write_generation += 1
+            self.logger.info("Inserted %d rows into %s.", len(rows), table_class.__tablename__)
+        except Exception as e:
+            self.logger.error("An error occurred while bulk inserting into %s: %s", table_class.__tablename__, e)
+
+    def add_volunteers(self, rows):
+        """
+        Bulk add volunteers to the database.
+
+        Parameters:
+            rows (list): List of dicts with keys first_name, last_name, initials, city.
+        """
+        self.add_many(Volunteer, rows)
+
+    def add_utility_providers(self, rows):
+        """
+        Bulk add utility providers to the database.
+
+        Parameters:
+            rows (list): List of dicts with keys company_name, mailing_address, phone_number, region.
+        """
+        self.add_many(UtilityProvider, rows)
+
+    def add_cities(self, rows):
+        """
+        Bulk add cities to the database.
+
+        Parameters:
+            rows (list): List of dicts with keys city, county, state, utility_provider.
+        """
+        self.add_many(City, rows)
+
+    def add_volunteer(self, first_name, last_name, initials, city, session=None):
+        """
+        Add a volunteer to the database.
+
+        Parameters:
+            first_name (str): First name of the volunteer.
+            last_name (str): Last name of the volunteer.
+            initials (str): Initials of the volunteer.
+            city (str): City of the volunteer.
+            session (obj): Optional Session from transaction(); when given, the
+                row joins the caller's transaction instead of committing here.
+        """
+        if session is not None:
+            session.add(Volunteer(first_name=first_name, last_name=last_name,
+                                  initials=initials, city=city))
+            return
+        self.add_many(Volunteer, [{'first_name': first_name, 'last_name': last_name,
+                                   'initials': initials, 'city': city}])
+
+    def add_utility_provider(self, company_name, mailing_address, phone_number, region, session=None):
         """
         Add a utility provider to the database.
 
@@ -131,20 +309,17 @@ class LeakDB:
             mailing_address (str): Mailing address of the utility provider.
             phone_number (str): Phone number of the utility provider.
             region (str): Region of the utility provider.
+            session (obj): Optional Session from transaction(); when given, the
+                row joins the caller's transaction instead of committing here.
         """
-        session = self.Session()
-        try:
-            provider = UtilityProvider(company_name=company_name, mailing_address=mailing_address, phone_number=phone_number, region=region)
-            session.add(provider)
-            session.commit()
-            self.logger.info(f"Utility provider {company_name} added successfully.")
-        except Exception as e:
-            session.rollback()
-            self.logger.error(f"An error occurred while adding a utility provider: {e}")
-        finally:
-            session.close()
+        if session is not None:
+            session.add(UtilityProvider(company_name=company_name, mailing_address=mailing_address,
+                                        phone_number=phone_number, region=region))
+            return
+        self.add_many(UtilityProvider, [{'company_name': company_name, 'mailing_address': mailing_address,
+                                         'phone_number': phone_number, 'region': region}])
 
-    def add_city(self, city_name, city_county, city_state, city_utility_provider):
+    def add_city(self, city_name, city_county, city_state, city_utility_provider, session=None):
         """
         Add a city to the database.
 
@@ -153,132 +328,229 @@ class LeakDB:
             city_county (str): County of the city.
             city_state (str): State of the city.
             city_utility_provider (str): Utility provider of the city.
+            session (obj): Optional Session from transaction(); when given, the
+                row joins the caller's transaction instead of committing here.
         """
-        session = self.Session()
+        if session is not None:
+            session.add(City(city=city_name, county=city_county,
+                             state=city_state, utility_provider=city_utility_provider))
+            return
+        self.add_many(City, [{'city': city_name, 'county': city_county,
+                              'state': city_state, 'utility_provider': city_utility_provider}])
+
+    def add_images(self, items):
+        """
+        Bulk add images to the database in one transaction.
+
+        One executemany and one commit for the whole batch; photo_id is the
+        primary key, so OR IGNORE makes re-ingesting already-stored images a
+        no-op instead of an IntegrityError.
+
+        Parameters:
+            items (iterable): Pairs of (photo_id, image_data bytes).
+        """
+        rows = [{'photo_id': idx, 'photo': image_data} for idx, image_data in items]
+        if not rows:
+            return
         try:
-            city = City(city=city_name, county=city_county, state=city_state, utility_provider=city_utility_provider)
-            session.add(city)
-            session.commit()
-            self.logger.info(f"City {city_name} added successfully.")
+            with self.engine.begin() as conn:
+                conn.execute(insert(Photo.__table__).prefix_with("OR IGNORE"), rows)
+            self._write_generation += 1
+            self.logger.info("Inserted %d images.", len(rows))
         except Exception as e:
-            session.rollback()
-            self.logger.error(f"An error occurred while adding a city: {e}")
-        finally:
-            session.close()
+            self.logger.error("An error occurred while bulk inserting %d images: %s", len(rows), e)
 
-    def add_image(self, idx, image_data):
+    def add_image(self, idx, image_data, session=None):
         """
         Add an image to the database.
 
         Parameters:
             idx (str): Unique identifier for the image.
             image_data (bytes): Binary data of the image.
+            session (obj): Optional Session from transaction(); when given, the
+                row joins the caller's transaction instead of committing here.
         """
-        session = self.Session()
-        try:
-            photo = Photo(photo_id=idx, photo=image_data)
-            session.add(photo)
-            session.commit()
-            self.logger.info(f"Image inserted into the database with photo_id: {idx}")
-        except Exception as e:
-            session.rollback()
-            self.logger.error(f"An error occurred while adding an image: {e}")
-        finally:
-            session.close()
+        if session is not None:
+            session.add(Photo(photo_id=idx, photo=image_data))
+            return
+        self.add_images([(idx, image_data)])
 
-    def insert_data_to_sql(self, dataframe, table_class):
+    def insert_data_to_sql(self, dataframe, table_class, connection=None):
         """
     Inserts data from a DataFrame into a specified SQL table, skipping duplicates.
-    
+
     :param dataframe: DataFrame containing the data to be inserted.
     :param model_class: The SQLAlchemy model class corresponding to the table.
+    :param connection: Optional open Connection; when given, the dedupe SELECT
+        and the insert both run on it, joining the caller's transaction.
     """
-        Session = sessionmaker(bind=self.engine)
-        session = Session()
-    
-        for index, row in dataframe.iterrows():
-            data = row.to_dict()
-            
-            # Check if the record already exists
-            existing_record = session.query(table_class).filter_by(**data).first()
-            if existing_record:
-                self.logger.info(f"Skipping duplicate record: {data}")
-                continue
-            
-            # If the record doesn't exist, insert it
-            try:
-                session.add(table_class(**data))
-                session.commit()
-            except IntegrityError as e:
-                session.rollback()
-                self.logger.error(f"IntegrityError: {e}")
-            except Exception as e:
-                session.rollback()
-                self.logger.error(f"An error occurred: {e}")
-        
-        session.close()
-
-    def print_all_tables_and_values(self):
+        records = dataframe.to_dict(orient='records')
+        if not records:
+            self.logger.info("No new records to insert into %s.", table_class.__tablename__)
+            return
+
+        table = table_class.__table__
+        columns = list(records[0].keys())
+
+        try:
+            # One SELECT over the candidate columns replaces the per-row
+            # duplicate-probe queries the old loop issued
+            select_stmt = select(*[table.c[name] for name in columns])
+            if connection is not None:
+                existing = {tuple(row) for row in connection.execute(select_stmt)}
+            else:
+                with self.engine.connect() as conn:
+                    existing = {tuple(row) for row in conn.execute(select_stmt)}
+            new_rows = [record for record in records
+                        if tuple(record[name] for name in columns) not in existing]
+
+            if not new_rows:
+                self.logger.info("No new records to insert into %s.", table_class.__tablename__)
+                return
+
+            # Single Core executemany in one transaction; OR IGNORE defers any
+            # remaining unique-column conflicts to the SQLite index
+            insert_stmt = insert(table).prefix_with("OR IGNORE")
+            if connection is not None:
+                connection.execute(insert_stmt, new_rows)
+            else:
+                with self.engine.begin() as conn:
+                    conn.execute(insert_stmt, new_rows)
+            self._write_generation += 1
+            self.logger.info("Inserted %d records into %s.", len(new_rows), table_class.__tablename__)
+        except IntegrityError as e:
+            self.logger.error("IntegrityError: %s", e)
+            # Inside a caller-managed transaction the error must propagate so
+            # the whole transaction rolls back instead of committing partially
+            if connection is not None:
+                raise
+        except Exception as e:
+            self.logger.error("An error occurred: %s", e)
+            if connection is not None:
+                raise
+
+    def print_all_tables_and_values(self, limit=50):
         """
         Print all tables and their values.
+
+        Parameters:
+            limit (int): Max rows logged per table. Default is 50.
         """
-        session = self.Session()
+        # Skip the query and string-building entirely when INFO is off
+        if not self.logger.isEnabledFor(logging.INFO):
+            return
         try:
-            tables = Base.metadata.tables.values()
-            for table in tables:
-                self.logger.info(f"Table: {table}")
-                stmt = select(table)
-                result = session.execute(stmt)
-                columns = table.columns.keys()
-                self.logger.info(f"Columns: {columns}")
-                for row in result:
-                    self.logger.info(row)
+            with self.engine.connect().execution_options(stream_results=True) as connection:
+                tables = Base.metadata.tables.values()
+                for table in tables:
+                    self.logger.info("Table: %s", table)
+                    # Leave BLOB columns out of the projection; a single photo row is megabytes
+                    columns = [col for col in table.columns if not isinstance(col.type, LargeBinary)]
+                    stmt = select(*columns).limit(limit)
+                    result = connection.execute(stmt)
+                    self.logger.info("Columns: %s", [col.name for col in columns])
+                    # One log record per fetched chunk rather than per row, so
+                    # the logging lock is taken once per 200 rows
+                    for chunk in result.yield_per(200).partitions():
+                        self.logger.info("\n".join(map(str, chunk)))
         except Exception as e:
-            self.logger.error(f"An error occurred: {e}")
-        finally:
-            session.close()
+            self.logger.error("An error occurred: %s", e)
+
+    def query_rows(self, query, params=None):
+        """
+        Execute a query and return the raw rows, without DataFrame construction.
+        Suited to debug printing and small lookups where a DataFrame is overhead.
+
+        Parameters:
+            query (str): SQL query to execute.
+            params (dict): Optional bind parameters.
+
+        Returns:
+            list: List of Row objects.
+        """
+        try:
+            with self.engine.connect() as connection:
+                return connection.execute(text(query), params or {}).fetchall()
+        except Exception as e:
+            self.logger.error("An error occurred while executing the query: %s", e)
+
+    def _run_query(self, query, generation):
+        """
+        Execute a read-only query and return a DataFrame. `generation` is only
+        part of the signature so the LRU cache key changes after writes.
+        """
+        results_df = pd.read_sql_query(text(query), self.engine)
+        return results_df
 
-    def query_db(self, query):
+    def query_db(self, query, cache=True, chunksize=None):
         """
         Execute a generic query on the database.
 
         Parameters:
             query (str): SQL query to execute.
+            cache (bool): Serve repeated read-only queries from an in-process
+                LRU cache, invalidated on writes. Default is True.
+            chunksize (int): If given, stream results and return an iterator of
+                DataFrames of this many rows instead of one DataFrame.
 
         Returns:
-            pandas.DataFrame: DataFrame containing the query results.
+            pandas.DataFrame or iterator of DataFrames (when chunksize is given).
         """
-        session = self.Session()
         try:
-            results = session.execute(text(query))
-            results_df = pd.DataFrame(results.fetchall(), columns=results.keys())
-            return results_df
+            if chunksize is not None:
+                return pd.read_sql_query(text(query), self.engine, chunksize=chunksize)
+            if cache:
+                return self._cached_query(query, self._write_generation)
+            return self._run_query(query, self._write_generation)
         except Exception as e:
-            self.logger.error(f"An error occurred while executing the query: {str(e)}")
-        finally:
-            session.close()
+            self.logger.error("An error occurred while executing the query: %s", e)
+
+    def _seeded(self):
+        """Return True only if all three reference tables hold the CSV seed data."""
+        with self.engine.connect() as connection:
+            for table_name in ('volunteers', 'utility_providers', 'cities'):
+                if connection.execute(text(f"SELECT 1 FROM {table_name} LIMIT 1")).first() is None:
+                    return False
+        return True
 
     def initialize_data(self):
         """
         Reads CSV files and inserts data into the respective tables.
+
+        Skipped entirely once the reference tables are populated, so routine
+        LeakDB construction doesn't re-read the CSVs or re-run the dedupe; a
+        fresh database seeds all three tables in one transaction.
         """
         try:
+            if self._seeded():
+                self.logger.info("Reference tables already populated; skipping CSV seed.")
+                return
+
             volunteers_df = pd.read_csv("data/project_data/volunteers.csv")
             volunteers_df.columns = volunteers_df.columns.str.strip()  # Strip any leading/trailing whitespace
             volunteers_df.index.name = 'volunteer_id'
-            self.logger.info(f'Volunteers DataFrame: \n{volunteers_df}')
-            self.insert_data_to_sql(volunteers_df, Volunteer)
-            
+            self.logger.info('Volunteers DataFrame: \n%s', volunteers_df)
+
             utilities_df = pd.read_csv("data/project_data/utilities.csv")
             utilities_df.columns = utilities_df.columns.str.strip()  # Strip any leading/trailing whitespace
             utilities_df.index.name = ''
-            self.logger.info(f'Utilties DataFrame: \n{utilities_df}')
-            self.insert_data_to_sql(utilities_df, UtilityProvider)
-            
+            self.logger.info('Utilties DataFrame: \n%s', utilities_df)
+
             cities_df = pd.read_csv("data/project_data/cities.csv")
             cities_df.columns = cities_df.columns.str.strip()  # Strip any leading/trailing whitespace
-            self.logger.info(f'Cities DataFrame: \n{cities_df}')
-            self.insert_data_to_sql(cities_df, City)
+            self.logger.info('Cities DataFrame: \n%s', cities_df)
+
+            # All three tables commit together (one fsync) and roll back together.
+            # Parents before children: volunteers.city references cities.city, and
+            # with PRAGMA foreign_keys=ON inserting volunteers first would fail.
+            with self.engine.begin() as connection:
+                self.insert_data_to_sql(utilities_df, UtilityProvider, connection=connection)
+                self.insert_data_to_sql(cities_df, City, connection=connection)
+                self.insert_data_to_sql(volunteers_df, Volunteer, connection=connection)
+
+            # Seed the planner statistics while the tables are fresh
+            with self.engine.begin() as connection:
+                connection.exec_driver_sql("ANALYZE")
         except FileNotFoundError as e:
             print(f"File not found: {e}")
             raise
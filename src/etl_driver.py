@@ -64,27 +64,40 @@ def main():
     etl_log.configure()
     etl_log.debug_mode(enable_debug=DEBUG)
 
-    # Init databaseand etl objects
-    database = LeakDB(PATH_TO_DB)
-    fetcher = FetchData(CREDENTIALS_PATH, GOOGLE_SHEET_ID, RANGE_NAME)
-    transformer = TransformData(PATH_TO_DB)
-    loader = LoadData(PATH_TO_DB)
-
-    # Create pipeline
-    pipe = ETLPipeline(database,
-                       fetcher,
-                       transformer,
-                       loader)
-    # Run pipe
-    pipe.pipe_data_to(TABLE_NAME)
-    
-    # Check db contents
-    database.print_all_tables_and_values()
-
-    # Query DB
-    #query="SELECT * FROM photos"
-    #df = database.query_db(query)
-    #print(df)
+    # Stop the queue listener however the run ends, so records still queued
+    # when main() returns (or raises) are flushed instead of dropped
+    try:
+        # Init database and etl objects; the with-block disposes the engine
+        # (and runs PRAGMA optimize) when the run ends
+        with LeakDB(PATH_TO_DB) as database:
+            fetcher = FetchData(CREDENTIALS_PATH, GOOGLE_SHEET_ID, RANGE_NAME)
+            transformer = TransformData(PATH_TO_DB)
+            loader = LoadData(PATH_TO_DB)
+
+            # Create pipeline
+            pipe = ETLPipeline(database,
+                               fetcher,
+                               transformer,
+                               loader)
+            # Run pipe
+            pipe.pipe_data_to(TABLE_NAME)
+
+            # Check db contents: full table dump only in debug mode; otherwise an O(1)
+            # sanity check served from the timestamp index
+            if DEBUG:
+                database.print_all_tables_and_values()
+            else:
+                summary = database.query_rows("SELECT COUNT(*), MIN(timestamp), MAX(timestamp) FROM measurements")
+                if summary:
+                    count, min_ts, max_ts = summary[0]
+                    print(f"Measurements: {count} rows, spanning {min_ts} to {max_ts}")
+
+            # Query DB
+            #query="SELECT * FROM photos"
+            #df = database.query_db(query)
+            #print(df)
+    finally:
+        etl_log.stop()
 
 #####################################################################################################################
 ## END
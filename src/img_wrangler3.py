@@ -1,7 +1,7 @@
 '''
-Helper class for TransformData class. Downloads images from Googe Drive and inserts to Image table in DB. 
+Helper class for TransformData class. Downloads images from Googe Drive and inserts to Image table in DB.
 
-This version uses multithreading for faster download time.
+This version uses asyncio + aiohttp for faster download time.
 
 Started: 8/26/2024
 Last Updated: 8/26/2024
@@ -12,19 +12,18 @@ Last Updated: 8/26/2024
 #####################################################################################################################
 
 import os
+import re
 import logging
-import requests
-import threading
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import asyncio
+import hashlib
+import tempfile
 
+import aiohttp
 import pandas as pd
-from sqlalchemy import create_engine, Column, String, LargeBinary
-from sqlalchemy.orm import sessionmaker
-from io import BytesIO
-from PIL import Image
+from sqlalchemy import create_engine, text, bindparam, Column, String, LargeBinary
 
 
-from db_manager import Photo, Base  
+from db_manager import Photo, Base, tune_sqlite_engine
 
 
 #####################################################################################################################
@@ -39,6 +38,11 @@ print(f"Current working directory: {current_dir}")
 ## Class
 #####################################################################################################################
 
+# Pulls the Drive file ID out of a ?id=<id> share link; compiled once and
+# shared with TransformData so both sides derive the same photo_id
+DRIVE_ID_RE = re.compile(r'[?&]id=([^&]+)')
+
+
 class ImageWrangler:
     """
     Takes image download links, downloads images, inserts them into the images table in the DB, and returns the image_id.
@@ -51,10 +55,14 @@ class ImageWrangler:
             path_to_db (str): Path to the SQLite database file.
         """
         self.path_to_db = path_to_db
-        self.engine = create_engine(self.path_to_db)
-        self.Session = sessionmaker(bind=self.engine)
+        self.engine = create_engine(self.path_to_db, insertmanyvalues_page_size=1000)
+        tune_sqlite_engine(self.engine)
         self.logger = logging.getLogger(self.__class__.__name__)
         self.img_dict = {}
+        self.max_concurrency = 50
+        # IDs known to be in the photos table, kept current across execute()
+        # calls so repeat runs skip both the SELECT and the re-download
+        self._known_ids = set()
 
     def get_download_links(self, image_links):
         """
@@ -64,11 +72,23 @@ class ImageWrangler:
             image_links (list): List of image links to be processed.
         """
         try:
-            existing_image_ids = pd.read_sql("SELECT photo_id FROM photos", self.engine)['photo_id'].tolist()
-            self.logger.info(f"Retrieved {len(existing_image_ids)} existing image IDs from the database.")
-
-            for image_link in image_links:
-                image_id = image_link.split('=')[1]
+            # Pull the Drive file IDs out in one vectorized regex pass; handles
+            # ?id=<id> links with extra query parameters, unlike split('=')
+            incoming_ids = (pd.Series(image_links, dtype='object')
+                            .str.extract(DRIVE_ID_RE, expand=False)
+                            .dropna()
+                            .tolist())
+            unknown_ids = [image_id for image_id in incoming_ids if image_id not in self._known_ids]
+            if unknown_ids:
+                stmt = text("SELECT photo_id FROM photos WHERE photo_id IN :ids").bindparams(
+                    bindparam('ids', expanding=True)
+                )
+                with self.engine.connect() as connection:
+                    self._known_ids.update(row[0] for row in connection.execute(stmt, {'ids': unknown_ids}))
+            existing_image_ids = self._known_ids
+            self.logger.info(f"Found {len(existing_image_ids.intersection(incoming_ids))} of {len(incoming_ids)} incoming image IDs already in the database.")
+
+            for image_id in incoming_ids:
                 download_url = f"https://drive.google.com/uc?export=download&id={image_id}"
 
                 if image_id in existing_image_ids:
@@ -83,77 +103,109 @@ class ImageWrangler:
         except Exception as e:
             self.logger.error(f"An unexpected error occurred while retrieving download links: {e}")
 
-    def download_image(self, image_id, download_url, session):
+    async def download_image(self, session, image_id, download_url):
         """
-        Download a single image and insert it into the database.
+        Download a single image and return its ID and binary data.
 
         Parameters:
+            session (aiohttp.ClientSession): Shared HTTP session.
             image_id (str): ID of the image.
             download_url (str): Direct download URL of the image.
-            session: SQLAlchemy session object.
+
+        Returns:
+            tuple: (image_id, file object or None, sha256 hex digest or None). The file
+            object is a SpooledTemporaryFile holding the body; large images spill to
+            disk instead of staying resident in memory. None if skipped or failed.
         """
         try:
             if download_url is None:
-                return False  # Image already exists in the database
-
-            with requests.Session() as req_session:
-                response = req_session.get(download_url, stream=True, timeout=10)
-                if response.status_code == 200:
+                return image_id, None, None  # Image already exists in the database
+
+            async with session.get(download_url, timeout=aiohttp.ClientTimeout(total=10)) as response:
+                if response.status == 200:
+                    # Stream the body in 64 KB chunks through the hash and into a
+                    # spooled temp file so the whole image never sits in RAM twice
+                    digest = hashlib.sha256()
+                    tmp = tempfile.SpooledTemporaryFile(max_size=2 * 1024 * 1024)
+                    async for chunk in response.content.iter_chunked(64 * 1024):
+                        digest.update(chunk)
+                        tmp.write(chunk)
+                    tmp.seek(0)
                     self.logger.info(f"Image {image_id} downloaded successfully.")
-                    self.insert_image(session=session, image_id=image_id, image_data=response.content)
-                    return True
+                    return image_id, tmp, digest.hexdigest()
                 else:
-                    self.logger.error(f"Failed to download image {image_id}. HTTP Status Code: {response.status_code}")
-                    return False
+                    self.logger.error(f"Failed to download image {image_id}. HTTP Status Code: {response.status}")
+                    return image_id, None, None
 
-        except requests.RequestException as e:
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
             self.logger.error(f"Failed to download image {image_id}. Network error: {e}")
-            return False
+            return image_id, None, None
 
-    def get_images_and_insert_to_db(self):
+    async def _fan_out(self):
         """
-        Download images using the URLs in img_dict and insert them into the database.
+        Download all images in img_dict concurrently over one HTTP session.
+
+        Returns:
+            list: List of (image_id, data) tuples.
         """
-        try:
-            db_session = self.Session()
+        # One connector for the whole batch: TCP+TLS handshakes to Drive are paid
+        # once per pooled connection, and idle keep-alive sockets stay reusable
+        # for 30 s between waves of downloads.
+        connector = aiohttp.TCPConnector(limit=self.max_concurrency,
+                                         limit_per_host=self.max_concurrency,
+                                         keepalive_timeout=30)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            tasks = [
+                self.download_image(session, image_id, download_url)
+                for image_id, download_url in self.img_dict.items()
+            ]
+            return await asyncio.gather(*tasks)
+
+    def get_images_and_insert_to_db(self, batch_size=50):
+        """
+        Download images using the URLs in img_dict and insert them into the database.
 
-            with ThreadPoolExecutor(max_workers=10) as executor:
-                future_to_image_id = {
-                    executor.submit(self.download_image, image_id, download_url, db_session): image_id
-                    for image_id, download_url in self.img_dict.items()
-                }
+        Downloads run as coroutines on the event loop; inserts happen afterwards
+        on the main thread in batches.
 
-                for future in as_completed(future_to_image_id):
-                    image_id = future_to_image_id[future]
-                    try:
-                        future.result()
-                    except Exception as e:
-                        self.logger.error(f"Error occurred while processing image {image_id}: {e}")
+        Parameters:
+            batch_size (int): Number of downloaded images per INSERT batch. Default is 50.
+        """
+        try:
+            results = asyncio.run(self._fan_out())
+
+            batch = []
+            for image_id, tmp, sha256 in results:
+                if tmp is not None:
+                    # Materialize the bytes only at insert time, one image at a time
+                    batch.append({'photo_id': image_id, 'photo': tmp.read(), 'photo_sha256': sha256})
+                    tmp.close()
+                if len(batch) >= batch_size:
+                    self.insert_images(batch)
+                    batch = []
+            if batch:
+                self.insert_images(batch)
 
         except Exception as e:
             self.logger.error(f"An unexpected error occurred while downloading images: {e}")
 
-        finally:
-            db_session.close()
-
-    def insert_image(self, session, image_id, image_data):
+    def insert_images(self, rows):
         """
-        Insert the downloaded image into the database.
+        Insert a batch of downloaded images into the database in one transaction.
 
         Parameters:
-            session (obj): SQLAlchemy session object.
-            image_id (str): Unique identifier for the image.
-            image_data (bytes): Binary data of the image.
+            rows (list): List of dicts with keys photo_id and photo.
         """
         try:
-            photo = Photo(photo_id=image_id, photo=image_data)
-            session.add(photo)
-            session.commit()
-            self.logger.info(f"Image {image_id} inserted successfully.")
+            # OR IGNORE so one already-present photo_id doesn't fail (and
+            # discard) the whole batch, matching LeakDB.add_images
+            with self.engine.begin() as conn:
+                conn.execute(Photo.__table__.insert().prefix_with("OR IGNORE"), rows)
+            self._known_ids.update(row['photo_id'] for row in rows)
+            self.logger.info(f"Inserted batch of {len(rows)} images successfully.")
 
         except Exception as e:
-            session.rollback()
-            self.logger.error(f"An error occurred while inserting image {image_id}: {e}")
+            self.logger.error(f"An error occurred while inserting a batch of {len(rows)} images: {e}")
 
     def execute(self, image_links):
         """
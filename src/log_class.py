@@ -10,8 +10,10 @@ Updated: 8/26/2024
 #####################################################################################################################
 
 import os
+import queue
 import logging
 from logging import Handler
+from logging.handlers import QueueHandler, QueueListener
 
 
 #####################################################################################################################
@@ -42,6 +44,7 @@ class Log:
         self.handlers = [logging.FileHandler(file_path)]
         if stream:
             self.handlers.append(logging.StreamHandler())
+        self.listener = None
 
     def stream_on(self):
         """
@@ -116,18 +119,65 @@ class Log:
         """
         Configures the logging with the current settings.
 
+        Log records are routed through an in-memory queue: the root logger only
+        pays for an enqueue, while a background QueueListener thread does the
+        actual file/stream writes off the hot path.
+
         Returns:
         -------
         self : Log
             The instance of the Log class.
         """
-        logging.basicConfig(
-            level=self.level,
-            format=self.format,
-            handlers=self.handlers
-        )
+        formatter = logging.Formatter(self.format)
+        for handler in self.handlers:
+            handler.setFormatter(formatter)
+
+        # Attach the QueueHandler directly (not via basicConfig, which would set
+        # its own formatter and bake the message in before the real handlers run)
+        log_queue = queue.Queue(-1)
+        root = logging.getLogger()
+        root.setLevel(self.level)
+        root.addHandler(QueueHandler(log_queue))
+        self.listener = QueueListener(log_queue, *self.handlers, respect_handler_level=True)
+        self.listener.start()
         return self
-    
+
+    def stop(self):
+        """
+        Stops the queue listener, flushing any buffered log records.
+
+        Returns:
+        -------
+        self : Log
+            The instance of the Log class.
+        """
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+        return self
+
+    def __enter__(self):
+        """
+        Configures logging on entry so the instance can be used as a context manager.
+
+        Returns:
+        -------
+        self : Log
+            The instance of the Log class.
+        """
+        return self.configure()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """
+        Stops the queue listener on exit, flushing any buffered log records.
+
+        The listener thread is a daemon: without this, records still queued at
+        interpreter shutdown are silently dropped.
+        """
+        self.stop()
+        return False
+
+
 #####################################################################################################################
 ## END
 #####################################################################################################################
\ No newline at end of file
@@ -12,7 +12,10 @@ Last Updated: 8/26/2024
 import os
 import sys
 import logging
+import traceback
 from pathlib import Path
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
 
 import pandas as pd
 from sqlalchemy import create_engine
@@ -31,6 +34,7 @@ print(f"Current working directory: {current_dir}")
 
 from log_class import Log
 from mapper_class import leakMapper
+from db_manager import tune_sqlite_engine
 
 #####################################################################################################################
 ## Parameters
@@ -45,6 +49,25 @@ print(f"Path to DB: {PATH_TO_DB}")
 ## Main
 #####################################################################################################################
 
+def render_city(city, path_to_db, html_dir):
+    '''
+    Renders and saves the leak map for one city.
+
+    Module-level (not a closure) so it is picklable for the worker processes.
+    Returns (city, None) on success or (city, traceback string) on failure —
+    the worker can't log usefully (it inherits the parent's QueueHandler but
+    the draining QueueListener thread only exists in the parent), so errors
+    are shipped back and logged by the parent instead of sinking the batch.
+    '''
+    try:
+        city_map = leakMapper(path_to_db, city)
+        city_map.create_map(html_dir=html_dir)
+        city_map.save_map(path_to_save_html=html_dir)
+        return city, None
+    except Exception:
+        return city, traceback.format_exc()
+
+
 def main():
 # Configure logging
     DEBUG = False
@@ -59,33 +82,43 @@ def main():
         logging.error(f"Failed to configure logging: {e}", exc_info=True)
         sys.exit(1)
 
-    # Query the database for a list of unique cities
+    # Stop the queue listener however the run ends, so records still queued
+    # when main() returns (or raises) are flushed instead of dropped
     try:
-        engine = create_engine(f'sqlite:///{PATH_TO_DB}')
-        query = "SELECT DISTINCT city FROM measurements;"
-        cities_df = pd.read_sql_query(query, engine)
-        cities = cities_df['city'].tolist()
-    except Exception as e:
-        logging.error(f"Failed to query the database: {e}", exc_info=True)
-        sys.exit(1)
-
-    # Generate maps for each city
-    for city in cities:
+        # Query the database for a list of unique cities
         try:
-            # Create map object
-            city_map = leakMapper(PATH_TO_DB, city)
-            city_map.create_map()
-
-            # Save map to HTML folder
-            path_to_map = os.path.join(os.getcwd(), 'html')
-            city_map.save_map(path_to_save_html=path_to_map)
-
-            # Open map in web browser
-            city_map.open_map()
-
+            engine = create_engine(f'sqlite:///{PATH_TO_DB}')
+            # Same WAL/synchronous=NORMAL tuning as LeakDB, so these readers are
+            # served from a snapshot instead of blocking behind ETL writes
+            tune_sqlite_engine(engine)
+            # GROUP BY walks ix_measurements_city (one step per distinct value)
+            # instead of scanning and sorting the whole measurements table
+            query = "SELECT city FROM measurements GROUP BY city;"
+            cities_df = pd.read_sql_query(query, engine)
+            cities = cities_df['city'].tolist()
         except Exception as e:
-            logging.error(f"Failed to process city {city}: {e}", exc_info=True)
-            continue  # Continue with the next city even if an error occurs
+            logging.error(f"Failed to query the database: {e}", exc_info=True)
+            sys.exit(1)
+
+        # Generate maps for each city in parallel: each city is independent
+        # (query, folium render, HTML write), so the batch is embarrassingly
+        # parallel across worker processes. Maps are no longer auto-opened in the
+        # browser — with one tab per city that fights the user, not helps them.
+        # Resolve and create the output directory once, before the workers start,
+        # instead of a getcwd()/makedirs round per city
+        html_dir = current_dir / 'html'
+        html_dir.mkdir(parents=True, exist_ok=True)
+        with ProcessPoolExecutor() as executor:
+            results = list(executor.map(partial(render_city, path_to_db=PATH_TO_DB, html_dir=str(html_dir)), cities))
+
+        # Workers can't reach the log file (see render_city), so failures come
+        # back as results and are logged here in the parent
+        failed = [(city, error) for city, error in results if error is not None]
+        for city, error in failed:
+            logging.error(f"Failed to process city {city}:\n{error}")
+        logging.info(f"Rendered {len(results) - len(failed)} of {len(results)} city maps.")
+    finally:
+        vis_log.stop()
 
 #####################################################################################################################
 ## END